@@ -69,7 +69,7 @@ class DataFeed(object):
             print('未找到对应Local Data File：{}'.format(local_data_path))
             return
         else:
-            store = pd.HDFStore(local_data_path)
+            store = pd.HDFStore(local_data_path, mode='r')  # 只读打开，避免改动文件修改时间
             store_keys = store.keys()
             store.close()
             return store_keys
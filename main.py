@@ -1,131 +1,229 @@
+import numpy as np
 from data_feed import DataFeed 
 from modules import BacktestRunner, ResultAnalyzer, plot_results, DataHandler, TradeManager, StrategyEngine
+from modules import SIG_NONE, SIG_BUY, SIG_SELL, SIG_CLOSE
+
+try:
+    from numba import njit, prange
+except ImportError:  # 未安装 numba 时退化为普通 Python 函数
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+    prange = range
 
 
 # ----------------------------- 策略函数 -----------------------------
-def ema_trend_strategy(row, instrument, initial_balance=100000, ema_windows=[5, 12, 20]):
+def bind_ema_trend_strategy(col_idx, instrument, initial_balance=100000):
     """
-    EMA趋势策略：基于大趋势和小趋势进行交易，实时计算EMA。
-    :param row: 当前 K 线数据
+    EMA趋势策略（逐 K 线版本的策略工厂），通过 load_strategy(bind_ema_trend_strategy, factory=True) 加载。
+    基于大趋势和小趋势进行交易，EMA由 BacktestRunner 预先计算；列位置在此一次性解析为常量，仓位状态保存在闭包中。
+    :param col_idx: 列名到列位置的映射
     :param instrument: 标的物代码
     :param initial_balance: 初始资金
-    :param ema_windows: EMA的计算窗口，例如 [5, 12, 20]
-    :return: 返回交易信号
+    :return: 返回只接收 row 的策略函数
     """
-    # 获取当前价格
-    price = row[f"{instrument}_15m_close"]
-    
-    # 初始化EMA计算器（如果尚未初始化）
-    if not hasattr(ema_trend_strategy, 'ema_calculator'):
-        ema_trend_strategy.ema_calculator = {}
-        for window in ema_windows:
-            ema_trend_strategy.ema_calculator[f"{instrument}_15m_ema_{window}"] = EMA(window)
-            ema_trend_strategy.ema_calculator[f"{instrument}_1h_ema_{window}"] = EMA(window)
-    
-    # 更新EMA值
-    for window in ema_windows:
-        ema_trend_strategy.ema_calculator[f"{instrument}_15m_ema_{window}"].update(price)
-        ema_trend_strategy.ema_calculator[f"{instrument}_1h_ema_{window}"].update(price)
-    
-    # 获取当前EMA值
-    ema_5_15m = ema_trend_strategy.ema_calculator[f"{instrument}_15m_ema_5"].value
-    ema_12_15m = ema_trend_strategy.ema_calculator[f"{instrument}_15m_ema_12"].value
-    ema_12_1h = ema_trend_strategy.ema_calculator[f"{instrument}_1h_ema_12"].value
-    ema_20_1h = ema_trend_strategy.ema_calculator[f"{instrument}_1h_ema_20"].value
-    
-    # 判断大趋势
-    if ema_12_1h > ema_20_1h:
-        major_trend = 'bull'
-    elif ema_12_1h < ema_20_1h:
-        major_trend = 'bear'
-    else:
-        major_trend = None
-    
-    # 判断小趋势
-    if ema_5_15m > ema_12_15m:
-        minor_trend = 'bull'
-    elif ema_5_15m < ema_12_15m:
-        minor_trend = 'bear'
-    else:
-        minor_trend = None
+    IDX_CLOSE_15M = col_idx[f"{instrument}_15m_close"]
+    IDX_EMA_5_15M = col_idx[f"{instrument}_15m_ema_5"]
+    IDX_EMA_12_15M = col_idx[f"{instrument}_15m_ema_12"]
+    IDX_EMA_12_1H = col_idx[f"{instrument}_1h_ema_12"]
+    IDX_EMA_20_1H = col_idx[f"{instrument}_1h_ema_20"]
+    # 仓位状态跨 K 线保存
+    state = {'direction': 0, 'position': 0, 'highest': None, 'lowest': None, 'stop': None}
+
+    def bound(row):
+        # 获取当前价格
+        price = row[IDX_CLOSE_15M]
+        if np.isnan(price):
+            return None  # 该时刻没有 15 分钟 K 线
+
+        # 读取预先计算的EMA值
+        ema_5_15m = row[IDX_EMA_5_15M]
+        ema_12_15m = row[IDX_EMA_12_15M]
+        ema_12_1h = row[IDX_EMA_12_1H]
+        ema_20_1h = row[IDX_EMA_20_1H]
+
+        # 判断大趋势
+        if ema_12_1h > ema_20_1h:
+            major_trend = 'bull'
+        elif ema_12_1h < ema_20_1h:
+            major_trend = 'bear'
+        else:
+            major_trend = None
     
-    # 初始化仓位和交易信号
-    signal = None
-    position = 0  # 当前仓位比例
-    stop_loss = None  # 止损价格
-    take_profit = None  # 止盈价格
-    highest_price = None  # 最高价
-    lowest_price = None  # 最低价
+        # 判断小趋势
+        if ema_5_15m > ema_12_15m:
+            minor_trend = 'bull'
+        elif ema_5_15m < ema_12_15m:
+            minor_trend = 'bear'
+        else:
+            minor_trend = None
     
-    # 多头趋势下的交易逻辑
-    if major_trend == 'bull' and minor_trend == 'bull':
-        if position == 0:
-            # 首次开仓
-            signal = 'buy'
-            position = 0.2  # 20%仓位
-            stop_loss = price * 0.9  # 初始止损
-            highest_price = price  # 记录最高价
-        elif position == 0.2 and price > highest_price * 1.1:
-            # 加仓30%
-            signal = 'buy'
-            position = 0.5  # 50%仓位
-            stop_loss = highest_price * 0.9  # 保持初始止损
-            highest_price = price  # 更新最高价
-        elif position == 0.5 and price > highest_price * 1.2:
-            # 满仓
-            signal = 'buy'
-            position = 1.0  # 100%仓位
-            stop_loss = highest_price * 0.9  # 保持初始止损
-            highest_price = price  # 更新最高价
+        signal = SIG_NONE
     
-    # 空头趋势下的交易逻辑
-    elif major_trend == 'bear' and minor_trend == 'bear':
-        if position == 0:
-            # 首次开仓
-            signal = 'sell'
-            position = 0.2  # 20%仓位
-            stop_loss = price * 1.1  # 初始止损
-            lowest_price = price  # 记录最低价
-        elif position == 0.2 and price < lowest_price * 0.9:
-            # 加仓30%
-            signal = 'sell'
-            position = 0.5  # 50%仓位
-            stop_loss = lowest_price * 1.1  # 保持初始止损
-            lowest_price = price  # 更新最低价
-        elif position == 0.5 and price < lowest_price * 0.8:
-            # 满仓
-            signal = 'sell'
-            position = 1.0  # 100%仓位
-            stop_loss = lowest_price * 1.1  # 保持初始止损
-            lowest_price = price  # 更新最低价
+        # 多头趋势下的交易逻辑
+        if major_trend == 'bull' and minor_trend == 'bull' and state['direction'] >= 0:
+            if state['position'] == 0:
+                # 首次开仓
+                signal = SIG_BUY
+                state.update(direction=1, position=0.2, stop=price * 0.9, highest=price)  # 20%仓位，初始止损
+            elif state['position'] == 0.2 and price > state['highest'] * 1.1:
+                # 加仓30%
+                signal = SIG_BUY
+                state.update(position=0.5, stop=state['highest'] * 0.9, highest=price)
+            elif state['position'] == 0.5 and price > state['highest'] * 1.2:
+                # 满仓
+                signal = SIG_BUY
+                state.update(position=1.0, stop=state['highest'] * 0.9, highest=price)
     
-    # 检查止损条件
-    if position > 0 and price <= stop_loss:
-        signal = 'close'  # 平仓
+        # 空头趋势下的交易逻辑
+        elif major_trend == 'bear' and minor_trend == 'bear' and state['direction'] <= 0:
+            if state['position'] == 0:
+                # 首次开仓
+                signal = SIG_SELL
+                state.update(direction=-1, position=0.2, stop=price * 1.1, lowest=price)
+            elif state['position'] == 0.2 and price < state['lowest'] * 0.9:
+                # 加仓30%
+                signal = SIG_SELL
+                state.update(position=0.5, stop=state['lowest'] * 1.1, lowest=price)
+            elif state['position'] == 0.5 and price < state['lowest'] * 0.8:
+                # 满仓
+                signal = SIG_SELL
+                state.update(position=1.0, stop=state['lowest'] * 1.1, lowest=price)
     
-    return signal
-
-
-# ----------------------------- EMA计算器 -----------------------------
-class EMA:
-    def __init__(self, window):
-        """
-        初始化EMA计算器。
-        :param window: EMA的窗口大小
-        """
-        self.window = window
-        self.alpha = 2 / (window + 1)  # EMA的平滑系数
-        self.value = None  # 当前EMA值
+        # 检查止损条件
+        if (state['direction'] == 1 and price <= state['stop']) or (state['direction'] == -1 and price >= state['stop']):
+            signal = SIG_CLOSE  # 平仓
+            state.update(direction=0, position=0, stop=None)
     
-    def update(self, price):
-        """
-        更新EMA值。
-        :param price: 当前价格
-        """
-        if self.value is None:
-            self.value = price  # 初始值为第一个价格
-        else:
-            self.value = self.alpha * price + (1 - self.alpha) * self.value
+        return {instrument: signal} if signal else None
+
+    return bound
+
+
+def ema_trend_strategy_vectorized(data, instrument, initial_balance=100000):
+    """
+    EMA趋势策略的向量化版本：整段数据只调用一次 JIT 编译的仓位状态机。
+    :param data: 回测区间内的合并 K 线数据（已包含预先计算的EMA列）
+    :param instrument: 标的物代码
+    :param initial_balance: 初始资金
+    :return: 返回交易信号列表 [(时间, {标的物代码: 信号}), ...]
+    """
+    # 只把数值数组传入 JIT 函数，不让 pandas 对象越过边界；保持列原有精度（downcast 时为 float32）
+    signals, positions, stops = run_state_machine(
+        data[f"{instrument}_15m_close"].to_numpy(),
+        data[f"{instrument}_15m_ema_5"].to_numpy(),
+        data[f"{instrument}_15m_ema_12"].to_numpy(),
+        data[f"{instrument}_1h_ema_12"].to_numpy(),
+        data[f"{instrument}_1h_ema_20"].to_numpy(),
+    )
+    return [(data.index[i], {instrument: int(signals[i])}) for i in np.flatnonzero(signals)]
+
+
+def ema_trend_strategy_universe(data, instruments, initial_balance=100000):
+    """
+    EMA趋势策略的批量版本：整个标的池的价格与EMA组成 (K 线数 × 标的物数) 矩阵，各标的物的状态机并行运行。
+    :param data: 回测区间内的合并 K 线数据（已包含预先计算的EMA列）
+    :param instruments: 标的物代码列表
+    :param initial_balance: 初始资金
+    :return: 返回交易信号列表 [(时间, {标的物代码: 信号, ...}), ...]
+    """
+    def matrix(suffix):
+        # 按列存储，使每个标的物的数据在内存中连续
+        columns = [f"{instrument}_{suffix}" for instrument in instruments]
+        return np.asfortranarray(data[columns].to_numpy())
+
+    signals, positions, stops = run_state_machine_2d(
+        matrix('15m_close'), matrix('15m_ema_5'), matrix('15m_ema_12'), matrix('1h_ema_12'), matrix('1h_ema_20'))
+    result = []
+    for i in np.flatnonzero(signals.any(axis=1)):
+        result.append((data.index[i], {instruments[j]: int(signals[i, j]) for j in np.flatnonzero(signals[i])}))
+    return result
+
+
+@njit(parallel=True, cache=True)
+def run_state_machine_2d(price, ema5_15m, ema12_15m, ema12_1h, ema20_1h):
+    """
+    对 (K 线数 × 标的物数) 矩阵的每一列运行 run_state_machine，各列之间并行。
+    :return: 返回与输入同形状的 (信号编码矩阵, 带方向的仓位矩阵, 止损价矩阵)
+    """
+    n, m = price.shape
+    signals = np.zeros((n, m), dtype=np.int8)
+    positions = np.zeros((n, m), dtype=np.float64)
+    stops = np.full((n, m), np.nan)
+    for j in prange(m):
+        signals[:, j], positions[:, j], stops[:, j] = run_state_machine(
+            price[:, j], ema5_15m[:, j], ema12_15m[:, j], ema12_1h[:, j], ema20_1h[:, j])
+    return signals, positions, stops
+
+
+@njit(cache=True)
+def run_state_machine(price, ema5_15m, ema12_15m, ema12_1h, ema20_1h):
+    """
+    仓位状态机：首次开仓20%，价格继续向有利方向运行10%/20%后加仓至50%/100%，触及止损后平仓。
+    :param price: 价格数组
+    :param ema5_15m: 15 分钟 EMA5
+    :param ema12_15m: 15 分钟 EMA12
+    :param ema12_1h: 1 小时 EMA12
+    :param ema20_1h: 1 小时 EMA20
+    :return: 返回 (信号编码数组, 带方向的仓位数组, 止损价数组)
+    """
+    n = price.shape[0]
+    signals = np.zeros(n, dtype=np.int8)
+    positions = np.zeros(n, dtype=np.float64)
+    stops = np.full(n, np.nan)
+
+    direction = 0  # 1 多头，-1 空头，0 空仓
+    position = 0.0  # 当前仓位比例
+    stop_loss = np.nan  # 止损价格
+    extreme_price = np.nan  # 多头记录最高价，空头记录最低价
+    for i in range(n):
+        current = price[i]
+        signal = SIG_NONE
+        if not np.isnan(current):
+            # 大趋势与小趋势同向时才开仓/加仓
+            long_entry = ema12_1h[i] > ema20_1h[i] and ema5_15m[i] > ema12_15m[i]
+            short_entry = ema12_1h[i] < ema20_1h[i] and ema5_15m[i] < ema12_15m[i]
+            if long_entry and direction >= 0:
+                if position == 0.0:
+                    # 首次开仓
+                    signal, direction, position = SIG_BUY, 1, 0.2
+                    stop_loss = current * 0.9
+                    extreme_price = current
+                elif position == 0.2 and current > extreme_price * 1.1:
+                    # 加仓30%
+                    signal, position = SIG_BUY, 0.5
+                    stop_loss = extreme_price * 0.9
+                    extreme_price = current
+                elif position == 0.5 and current > extreme_price * 1.2:
+                    # 满仓
+                    signal, position = SIG_BUY, 1.0
+                    stop_loss = extreme_price * 0.9
+                    extreme_price = current
+            elif short_entry and direction <= 0:
+                if position == 0.0:
+                    signal, direction, position = SIG_SELL, -1, 0.2
+                    stop_loss = current * 1.1
+                    extreme_price = current
+                elif position == 0.2 and current < extreme_price * 0.9:
+                    signal, position = SIG_SELL, 0.5
+                    stop_loss = extreme_price * 1.1
+                    extreme_price = current
+                elif position == 0.5 and current < extreme_price * 0.8:
+                    signal, position = SIG_SELL, 1.0
+                    stop_loss = extreme_price * 1.1
+                    extreme_price = current
+
+            # 检查止损条件
+            if (direction == 1 and current <= stop_loss) or (direction == -1 and current >= stop_loss):
+                signal = SIG_CLOSE
+                direction, position = 0, 0.0
+                stop_loss = np.nan
+
+        signals[i] = signal
+        positions[i] = direction * position
+        stops[i] = stop_loss
+    return signals, positions, stops
 
 
 # ----------------------------- 主程序 -----------------------------
@@ -143,16 +241,16 @@ if __name__ == "__main__":
     )
 
     # 加载策略
-    backtester.strategy_engine.load_strategy(ema_trend_strategy)
+    backtester.strategy_engine.load_strategy(ema_trend_strategy_vectorized, vectorized=True)
 
     # 运行回测
     backtester.run_backtest(instrument='000300.XSHG')
 
     # 生成回测报告
-    analyzer = ResultAnalyzer(backtester.trade_manager.trades_log)
+    analyzer = ResultAnalyzer(backtester.trade_manager.trades_df())
     report = analyzer.generate_report()
     print("回测报告:", report)
 
     # 可视化结果
     merged_data = backtester.data_handler.merge_data(['000300.XSHG'], ['15m', '1h'])
-    plot_results(merged_data, backtester.trade_manager.trades_log, '000300.XSHG')
+    plot_results(merged_data, backtester.trade_manager.trades_df(), '000300.XSHG', interactive=True)
@@ -1,25 +1,127 @@
 import os
+import hashlib
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import matplotlib.pyplot as plt
 from data_feed import DataFeed  # 假设这是您的数据接口模块
 
+# 交易信号编码：策略与 TradeManager 内部使用整数，只在输出报告时转换为字符串
+SIG_NONE, SIG_BUY, SIG_SELL, SIG_CLOSE = 0, 1, -1, 2
+SIGNAL_NAMES = {SIG_BUY: 'buy', SIG_SELL: 'sell', SIG_CLOSE: 'close'}
+SIGNAL_CODES = {name: code for code, name in SIGNAL_NAMES.items()}
+
+
+def signal_codes(signals):
+    """
+    将信号序列统一转换为整数编码，兼容字符串信号（例如字典列表形式的交易记录）。
+    :param signals: 信号序列
+    :return: 返回 int8 数组
+    """
+    signals = pd.Series(signals)
+    if signals.dtype == object or pd.api.types.is_string_dtype(signals):
+        signals = signals.map(lambda signal: SIGNAL_CODES.get(signal, signal))
+    return signals.to_numpy(dtype=np.int8)
+
+
 # ----------------------------- DataHandler 模块 -----------------------------
 class DataHandler:
-    def __init__(self, datafeed):
+    def __init__(self, datafeed, cache_dir='./cache/', downcast=False):
         """
         初始化 DataHandler，设置数据接口。
         :param datafeed: 数据接口对象
+        :param cache_dir: Parquet 缓存目录，为 None 时不使用磁盘缓存
+        :param downcast: 为 True 时合并后的 OHLC 价格列转为 float32（成交量、成交额保持 float64）
         """
         self.datafeed = datafeed
+        self.cache_dir = cache_dir
+        self.downcast = downcast
+        self._cache = {}  # 进程内缓存：(instrument, period) -> pyarrow.Table
 
     def load_local_data(self, instrument, period):
         """
         读取指定标的物和周期的 K 线数据。
+        同一 DataHandler 内按 (instrument, period) 缓存；首次读取后同时写入 Parquet 缓存，
+        之后（包括组合回测的子进程）直接以内存映射方式读取 Parquet。
+        本地数据文件的大小或修改时间与生成缓存时记录的不一致时自动重新读取。
         :param instrument: 标的物代码，例如 '000300.XSHG'
         :param period: 周期，例如 '1m'（1 分钟）
-        :return: 返回对应的 DataFrame
+        :return: 返回对应的 pyarrow.Table，时间在 'datetime' 列中
+        """
+        key = (instrument, period)
+        if key not in self._cache:
+            self._cache[key] = self._load_table(instrument, period)
+        return self._cache[key]
+
+    def _cache_path(self, instrument, period):
+        """
+        Parquet 缓存路径：按本地数据文件的绝对路径分子目录，不同数据目录的缓存互不干扰。
+        """
+        source_path = os.path.abspath(self.datafeed.get_local_data_path(instrument))
+        source_key = hashlib.md5(source_path.encode('utf-8')).hexdigest()[:16]
+        # 文件名中的版本号对应缓存格式（v2：时间存放在 'datetime' 列中），格式变化时需递增
+        return source_path, os.path.join(self.cache_dir, source_key, f"{instrument}_{period}.v2.parquet")
+
+    @staticmethod
+    def _source_stamp(source_path):
+        """
+        本地数据文件的 "大小:修改时间(ns)"，写入 Parquet 元数据，用于判断缓存是否过期。
+        """
+        stat = os.stat(source_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8')
+
+    def _load_table(self, instrument, period):
+        cache_path = stamp = None
+        if self.cache_dir is not None:
+            source_path, cache_path = self._cache_path(instrument, period)
+            # 在读取 HDF5 之前记录源文件状态；命中时只需 os.stat，不打开 HDF5 文件
+            stamp = self._source_stamp(source_path)
+            table = self._read_cache(cache_path)
+            if table is not None:
+                metadata = table.schema.metadata or {}
+                if metadata.get(b'source_stamp') == stamp and 'datetime' in table.column_names:
+                    return table
+                # 过期或格式不符的缓存文件，重新从本地数据生成
+
+        df = self._index_by_datetime(self.datafeed.load_local_data(instrument, period))
+        table = pa.Table.from_pandas(df.rename_axis('datetime').reset_index(), preserve_index=False)
+        # 去掉 pandas 元数据（列名由 merge_data 重命名），只保留源文件状态
+        table = table.replace_schema_metadata({b'source_stamp': stamp} if stamp is not None else None)
+        if cache_path is not None:
+            self._write_cache(table, cache_path)
+        return table
+
+    @staticmethod
+    def _read_cache(cache_path):
+        """
+        以内存映射方式读取 Parquet 缓存；文件不存在或已损坏（例如写入中途被中断）时返回 None，按未命中处理。
+        """
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            return pq.read_table(cache_path, memory_map=True)
+        except (pa.ArrowInvalid, OSError):
+            return None
+
+    @staticmethod
+    def _write_cache(table, cache_path):
         """
-        return self.datafeed.load_local_data(instrument, period)
+        先写入同目录下的临时文件再原子替换，避免并行子进程或中断的写入留下不完整的缓存文件。
+        """
+        cache_dir = os.path.dirname(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pq.write_table(table, f)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
 
     def merge_data(self, instruments, periods):
         """
@@ -28,17 +130,56 @@ class DataHandler:
         :param periods: 周期列表，例如 ['1m', '5m']
         :return: 返回合并后的 DataFrame
         """
-        merged_df = None
+        frames = []
         for instrument in instruments:
             for period in periods:
-                df = self.load_local_data(instrument, period)
-                df = df.add_prefix(f"{instrument}_{period}_")  # 为列添加前缀以区分资产和周期
-                if merged_df is None:
-                    merged_df = df
-                else:
-                    merged_df = merged_df.join(df, how='outer')  # 按时间对齐合并
+                table = self.load_local_data(instrument, period)
+                # 为列添加前缀以区分资产和周期：只修改 Arrow schema，不复制列数据
+                table = table.rename_columns([name if name == 'datetime' else f"{instrument}_{period}_{name}"
+                                              for name in table.column_names])
+                frames.append(table.to_pandas().set_index('datetime'))
+        # 一次性按时间对齐合并，避免逐个 join 反复重建索引
+        merged_df = pd.concat(frames, axis=1, join='outer', sort=True)
+        if self.downcast:
+            ohlc = [col for col in merged_df.columns
+                    if col.rsplit('_', 1)[-1] in ('open', 'high', 'low', 'close') and merged_df[col].dtype == np.float64]
+            merged_df = merged_df.astype({col: np.float32 for col in ohlc})
         return merged_df
 
+    @staticmethod
+    def _index_by_datetime(df):
+        """
+        以 date + time 列构造 DatetimeIndex，使不同周期的数据能够按时间对齐。
+        :param df: K 线数据
+        :return: 返回以时间为索引的 DataFrame
+        """
+        if isinstance(df.index, pd.DatetimeIndex):
+            return df
+        index = pd.to_datetime(df['date'] + ' ' + df['time'])
+        return df.drop(columns=['date', 'time']).set_index(index)
+
+    def add_ema_columns(self, merged_df, instruments, periods, ema_windows):
+        """
+        在合并后的数据上一次性计算所有 EMA 指标列，列名形如 '000300.XSHG_15m_ema_5'。
+        :param merged_df: 合并后的 DataFrame
+        :param instruments: 标的物代码列表
+        :param periods: 周期列表
+        :param ema_windows: EMA的计算窗口列表，例如 [5, 12, 20]
+        :return: 返回添加了 EMA 列的 DataFrame
+        """
+        ema_columns = {}
+        for period in periods:
+            # 各标的物同一周期的收盘价组成 (K 线数 × 标的物数) 矩阵，每个窗口只做一次 ewm
+            close = merged_df[[f"{instrument}_{period}_close" for instrument in instruments]]
+            dtype = np.result_type(*close.dtypes)
+            for window in ema_windows:
+                # ignore_na=True：每列只在该周期自身的 K 线上递推，再向前填充到合并后的时间轴
+                ema = close.ewm(alpha=2 / (window + 1), adjust=False, ignore_na=True).mean().ffill()
+                ema = ema.to_numpy(dtype=dtype)  # 与收盘价同精度（downcast 时为 float32）
+                for j, instrument in enumerate(instruments):
+                    ema_columns[f"{instrument}_{period}_ema_{window}"] = ema[:, j]
+        return merged_df.assign(**ema_columns)
+
 
 # ----------------------------- StrategyEngine 模块 -----------------------------
 class StrategyEngine:
@@ -47,79 +188,203 @@ class StrategyEngine:
         初始化 StrategyEngine。
         """
         self.strategy_function = None
+        self.vectorized = False
+        self.factory = False
 
-    def load_strategy(self, strategy_function):
+    def load_strategy(self, strategy_function, vectorized=False, factory=False):
         """
         加载用户定义的策略函数。
         :param strategy_function: 用户定义的策略函数
+        :param vectorized: 为 True 时策略函数一次性接收整段数据并直接返回交易信号列表，
+                           否则逐根 K 线调用
+        :param factory: 为 True 时策略函数是工厂 factory(col_idx, **strategy_params)，
+                        由其一次性解析列位置并返回只接收 row 的函数（可在闭包中保存跨 K 线状态）
         """
+        if vectorized and factory:
+            raise ValueError("vectorized 与 factory 不能同时为 True")
         self.strategy_function = strategy_function
+        self.vectorized = vectorized
+        self.factory = factory
+
+    def bind(self, instrument, columns, **strategy_params):
+        """
+        针对指定标的物和列布局特化已加载的逐 K 线策略，返回只接收 row 的函数。
+        以 factory=True 加载的策略直接调用工厂 factory(col_idx, **strategy_params)；
+        否则返回把 col_idx 和策略参数固定下来的闭包。
+        :param instrument: 标的物代码，为 None 时不传给策略函数
+        :param columns: 数据的列名序列，row 按此顺序排列
+        :param strategy_params: 策略参数
+        :return: 返回特化后的策略函数
+        """
+        if self.strategy_function is None:
+            raise ValueError("未加载策略函数")
 
-    def run_strategy(self, data, start_time, end_time, **strategy_params):
+        col_idx = {col: i for i, col in enumerate(columns)}  # 列名 -> 列位置
+        if instrument is not None:
+            strategy_params = dict(strategy_params, instrument=instrument)
+        if self.factory:
+            return self.strategy_function(col_idx, **strategy_params)
+
+        strategy_function = self.strategy_function
+
+        def bound(row):
+            return strategy_function(row, col_idx=col_idx, **strategy_params)
+        return bound
+
+    def run_strategy(self, data, start_time, end_time, trade_manager=None, **strategy_params):
         """
         在指定时间范围内运行策略。
+        传入 trade_manager 时，在同一次遍历中按 1 分钟收盘价执行交易并更新止损止盈。
         :param data: 合并后的 K 线数据 DataFrame
         :param start_time: 回测开始时间
         :param end_time: 回测结束时间
+        :param trade_manager: 交易管理对象，为 None 时只计算信号
         :param strategy_params: 策略参数
         :return: 返回交易信号列表
         """
         if self.strategy_function is None:
             raise ValueError("未加载策略函数")
         
-        signals = []
         filtered_data = data.loc[start_time:end_time]  # 过滤时间范围
-        for idx, row in filtered_data.iterrows():
-            signal = self.strategy_function(row, **strategy_params)  # 执行策略函数
-            if signal:
-                signals.append((idx, signal))  # 记录交易信号和时间
+        if self.vectorized:
+            signals = self.strategy_function(filtered_data, **strategy_params)  # 整段数据一次性计算
+            if trade_manager is None:
+                return signals
+            # 信号时间 -> 行位置，遍历时按位置取出信号
+            signal_at = {}
+            for pos, (_, signal) in zip(filtered_data.index.get_indexer([time for time, _ in signals]), signals):
+                signal_at.setdefault(pos, {}).update(signal)
+            trade_manager.reserve(trade_manager.n + sum(len(signal) for _, signal in signals))
+        else:
+            signals = []
+            instrument = strategy_params.pop('instrument', None)
+            strategy = self.bind(instrument, filtered_data.columns, **strategy_params)
+
+        col_idx = {col: i for i, col in enumerate(filtered_data.columns)}  # 列名 -> 列位置
+        # 各标的物 1 分钟收盘价所在的列位置，用于成交价和止损更新
+        close_idx = {col[:-len('_1m_close')]: i for col, i in col_idx.items() if col.endswith('_1m_close')}
+        values = filtered_data.values
+        index = filtered_data.index
+        for i, idx in enumerate(index):
+            row = values[i]  # 按位置访问，避免逐行构造 Series
+            if self.vectorized:
+                signal = signal_at.get(i)
+            else:
+                signal = strategy(row)  # 执行策略函数
+                if signal:
+                    signals.append((idx, signal))  # 记录交易信号和时间
+            if trade_manager is not None:
+                if signal:
+                    for instrument, action in signal.items():
+                        trade_manager.execute_trade(action, idx, row[close_idx[instrument]], instrument)
+                trade_manager.update_stop_loss(idx, row, close_idx)
         return signals
 
 
 # ----------------------------- TradeManager 模块 -----------------------------
 class TradeManager:
-    def __init__(self):
+    # 交易记录的列：列名 -> (数组属性名, dtype)
+    TRADE_COLUMNS = {
+        'instrument': ('instruments', object),
+        'time': ('times', 'datetime64[ns]'),
+        'signal': ('signals', np.int8),
+        'price': ('prices', np.float64),
+        'stop_loss': ('stop_loss', np.float64),
+        'take_profit': ('take_profit', np.float64),
+        'highest_price': ('highest_price', np.float64),
+        'lowest_price': ('lowest_price', np.float64),
+    }
+
+    def __init__(self, max_trades=1024):
         """
-        初始化 TradeManager。
+        初始化 TradeManager。交易记录按列存放在预分配的 NumPy 数组中（而不是逐笔的字典列表）。
+        :param max_trades: 预分配的交易记录条数，不足时自动扩容
         """
-        self.trades_log = []
-        self.positions = {}  # 记录当前持仓
+        self.n = 0  # 已记录的交易笔数
+        for attr, dtype in self.TRADE_COLUMNS.values():
+            setattr(self, attr, self._empty(max_trades, dtype))
+        self.positions = {}  # 记录当前持仓：标的物代码 -> 交易记录下标
+
+    @staticmethod
+    def _empty(size, dtype):
+        return np.full(size, np.nan) if dtype is np.float64 else np.empty(size, dtype=dtype)
+
+    def reserve(self, size):
+        """
+        确保交易记录数组至少能容纳 size 笔交易。
+        :param size: 需要容纳的交易笔数
+        """
+        capacity = len(self.prices)
+        if size <= capacity:
+            return
+        capacity = max(size, capacity * 2)
+        for attr, dtype in self.TRADE_COLUMNS.values():
+            grown = self._empty(capacity, dtype)
+            grown[:self.n] = getattr(self, attr)[:self.n]
+            setattr(self, attr, grown)
 
     def execute_trade(self, signal, current_time, price, instrument):
         """
         记录交易执行信息。
-        :param signal: 交易信号，例如 'buy' 或 'sell'
+        :param signal: 交易信号编码，例如 SIG_BUY 或 SIG_SELL（也接受 'buy' / 'sell' 等字符串）
         :param current_time: 交易时间
         :param price: 交易价格
         :param instrument: 标的物代码
         """
-        trade = {
-            'instrument': instrument,
-            'time': current_time,
-            'signal': signal,
-            'price': price,
-            'stop_loss': price * 0.9 if signal == 'buy' else price * 1.1,  # 初始止损
-            'take_profit': None,
-            'highest_price': price if signal == 'buy' else None,  # 跟踪最高价
-            'lowest_price': price if signal == 'sell' else None   # 跟踪最低价
-        }
-        self.trades_log.append(trade)
-        self.positions[instrument] = trade  # 更新持仓
+        if isinstance(signal, str):
+            signal = SIGNAL_CODES[signal]
+        self.reserve(self.n + 1)
+        k = self.n
+        self.instruments[k] = instrument
+        self.times[k] = current_time
+        self.signals[k] = signal
+        self.prices[k] = price
+        self.stop_loss[k] = price * 0.9 if signal == SIG_BUY else price * 1.1  # 初始止损
+        if signal == SIG_BUY:
+            self.highest_price[k] = price  # 跟踪最高价
+        elif signal == SIG_SELL:
+            self.lowest_price[k] = price  # 跟踪最低价
+        self.n += 1
+        self.positions[instrument] = k  # 更新持仓
 
-    def update_stop_loss(self, current_time, price_data):
+    def append_trades(self, trades):
+        """
+        批量追加交易记录，例如汇总组合回测各子进程的结果。
+        :param trades: trades_df() 格式的交易记录 DataFrame
+        """
+        self.reserve(self.n + len(trades))
+        for column, (attr, _) in self.TRADE_COLUMNS.items():
+            values = signal_codes(trades[column]) if column == 'signal' else trades[column].to_numpy()
+            getattr(self, attr)[self.n:self.n + len(trades)] = values
+        self.n += len(trades)
+
+    def trades_df(self, labels=False):
+        """
+        以 DataFrame 形式返回交易记录。
+        :param labels: 为 True 时 signal 列转换为 'buy' / 'sell' / 'close' 字符串，用于输出展示
+        :return: 每行一笔交易的 DataFrame
+        """
+        trades = pd.DataFrame({column: getattr(self, attr)[:self.n]
+                               for column, (attr, _) in self.TRADE_COLUMNS.items()})
+        if labels:
+            trades['signal'] = trades['signal'].map(SIGNAL_NAMES)
+        return trades
+
+    def update_stop_loss(self, current_time, price_data, close_idx):
         """
         更新止损止盈价格。
         :param current_time: 当前时间
-        :param price_data: 当前价格数据
+        :param price_data: 当前价格数据（按列位置排列的一行数据）
+        :param close_idx: 标的物代码到其 1 分钟收盘价列位置的映射
         """
-        for instrument, position in self.positions.items():
-            current_price = price_data[f"{instrument}_1m_close"]  # 假设使用 1 分钟周期的收盘价
-            if position['signal'] == 'buy':
-                position['highest_price'] = max(position['highest_price'], current_price)
-                position['stop_loss'] = position['highest_price'] * 0.9  # 跟踪止损
-            elif position['signal'] == 'sell':
-                position['lowest_price'] = min(position['lowest_price'], current_price)
-                position['stop_loss'] = position['lowest_price'] * 1.1  # 跟踪止损
+        for instrument, k in self.positions.items():
+            current_price = price_data[close_idx[instrument]]  # 假设使用 1 分钟周期的收盘价
+            if self.signals[k] == SIG_BUY:
+                self.highest_price[k] = max(self.highest_price[k], current_price)
+                self.stop_loss[k] = self.highest_price[k] * 0.9  # 跟踪止损
+            elif self.signals[k] == SIG_SELL:
+                self.lowest_price[k] = min(self.lowest_price[k], current_price)
+                self.stop_loss[k] = self.lowest_price[k] * 1.1  # 跟踪止损
 
 
 # ----------------------------- ResultAnalyzer 模块 -----------------------------
@@ -127,7 +392,7 @@ class ResultAnalyzer:
     def __init__(self, trades_log):
         """
         初始化 ResultAnalyzer。
-        :param trades_log: 交易记录
+        :param trades_log: 交易记录（TradeManager.trades_df() 或字典列表）
         """
         self.trades_log = trades_log
 
@@ -136,17 +401,20 @@ class ResultAnalyzer:
         生成回测报告。
         :return: 返回回测报告字典
         """
-        if not self.trades_log:
+        trades = pd.DataFrame(self.trades_log)
+        if trades.empty:
             return {}
 
-        # 计算总收益
+        # 计算总收益：每笔交易持有至同一标的物的下一笔交易，未平仓的最后一笔不计入
         initial_balance = 100000  # 初始资金
-        balance = initial_balance
-        for trade in self.trades_log:
-            if trade['signal'] == 'buy':
-                balance *= (trade['close_price'] / trade['price'])
-            elif trade['signal'] == 'sell':
-                balance *= (trade['price'] / trade['close_price'])
+        if 'close_price' not in trades:
+            trades['close_price'] = trades.groupby('instrument')['price'].shift(-1)
+        signal = signal_codes(trades['signal'])
+        price = trades['price'].to_numpy(dtype=np.float64)
+        close_price = trades['close_price'].to_numpy(dtype=np.float64)
+        ratio = np.select([signal == SIG_BUY, signal == SIG_SELL],
+                          [close_price / price, price / close_price], default=1.0)
+        balance = float(initial_balance * np.nanprod(ratio))
 
         total_return = (balance - initial_balance) / initial_balance
         return {
@@ -158,27 +426,31 @@ class ResultAnalyzer:
 
 # ----------------------------- BacktestRunner 模块 -----------------------------
 class BacktestRunner:
-    def __init__(self, datafeed):
+    def __init__(self, datafeed, downcast=False, cache_dir='./cache/'):
         """
         初始化 BacktestRunner。
         :param datafeed: 数据接口对象
+        :param downcast: 是否将合并后的 OHLC 价格列转为 float32，见 DataHandler
+        :param cache_dir: Parquet 缓存目录，为 None 时不使用磁盘缓存，见 DataHandler
         """
-        self.data_handler = DataHandler(datafeed)
+        self.data_handler = DataHandler(datafeed, cache_dir=cache_dir, downcast=downcast)
         self.strategy_engine = StrategyEngine()
         self.trade_manager = TradeManager()
 
-    def set_parameters(self, instruments, periods, start_time, end_time):
+    def set_parameters(self, instruments, periods, start_time, end_time, ema_windows=[5, 12, 20]):
         """
         设置回测参数。
         :param instruments: 标的物代码列表
         :param periods: 周期列表
         :param start_time: 回测开始时间
         :param end_time: 回测结束时间
+        :param ema_windows: 预先计算的 EMA 窗口列表
         """
         self.instruments = instruments
         self.periods = periods
         self.start_time = start_time
         self.end_time = end_time
+        self.ema_windows = ema_windows
 
     def run_backtest(self, **strategy_params):
         """
@@ -187,39 +459,99 @@ class BacktestRunner:
         """
         # 读取和合并数据
         merged_data = self.data_handler.merge_data(self.instruments, self.periods)
+        merged_data = self.data_handler.add_ema_columns(merged_data, self.instruments, self.periods, self.ema_windows)
 
-        # 运行策略
-        signals = self.strategy_engine.run_strategy(merged_data, self.start_time, self.end_time, **strategy_params)
+        # 运行策略，同时记录交易并更新止损止盈
+        self.strategy_engine.run_strategy(merged_data, self.start_time, self.end_time,
+                                          trade_manager=self.trade_manager, **strategy_params)
 
-        # 记录交易
-        for time, signal in signals:
-            for instrument, action in signal.items():
-                price = merged_data.loc[time][f"{instrument}_1m_close"]  # 假设使用 1 分钟周期的收盘价
-                self.trade_manager.execute_trade(action, time, price, instrument)
+    def run_portfolio(self, instruments, max_workers=None, batched=False, **strategy_params):
+        """
+        多标的组合回测：每个标的物在独立进程中运行一次单标的回测，结果汇总到 trade_manager。
+        batched=True 时不再按标的物拆分：整个标的池只读取、合并一次数据，EMA 按 (K 线数 × 标的物数) 矩阵计算，
+        并把全部标的物交给向量化策略一次性生成信号（策略需接收 instruments 参数）。
+        子进程以 spawn 方式启动，调用脚本需放在 if __name__ == "__main__": 下，策略函数需可被子进程导入。
+        :param instruments: 标的物代码列表
+        :param max_workers: 进程数，默认为 CPU 核数
+        :param batched: 是否在当前进程内对整个标的池批量回测
+        :param strategy_params: 策略参数（instrument / instruments 参数自动传入）
+        """
+        if self.strategy_engine.strategy_function is None:
+            raise ValueError("未加载策略函数")
+        for name in ('instrument', 'instruments'):
+            if name in strategy_params:
+                raise ValueError(f"组合回测会自动传入 {name} 参数，请不要在策略参数中指定")
+
+        if batched:
+            if not self.strategy_engine.vectorized:
+                raise ValueError("批量组合回测需要加载向量化策略函数")
+            merged_data = self.data_handler.merge_data(instruments, self.periods)
+            merged_data = self.data_handler.add_ema_columns(merged_data, instruments, self.periods, self.ema_windows)
+            self.strategy_engine.run_strategy(merged_data, self.start_time, self.end_time,
+                                              trade_manager=self.trade_manager, instruments=instruments,
+                                              **strategy_params)
+            return
+
+        # 使用 spawn 启动子进程：当前进程可能已启动 numba 的并行线程池（batched 路径），fork 后子进程会死锁
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(_worker, self.data_handler.datafeed, self.data_handler.downcast,
+                                self.data_handler.cache_dir,
+                                instrument, self.periods, self.start_time, self.end_time, self.ema_windows,
+                                self.strategy_engine.strategy_function, self.strategy_engine.vectorized,
+                                self.strategy_engine.factory, strategy_params): instrument
+                for instrument in instruments
+            }
+            results = [future.result() for future in as_completed(futures)]
+        if results:
+            trades = pd.concat(results, ignore_index=True).sort_values('time', kind='stable')
+            self.trade_manager.append_trades(trades)
 
-        # 更新止损止盈
-        for idx, row in merged_data.loc[self.start_time:self.end_time].iterrows():
-            self.trade_manager.update_stop_loss(idx, row)
+
+def _worker(datafeed, downcast, cache_dir, instrument, periods, start_time, end_time, ema_windows,
+            strategy_function, vectorized, factory, strategy_params):
+    """
+    组合回测的子进程入口：在进程内自行读取数据，避免在进程间传递大 DataFrame。
+    :return: 返回该标的物的交易记录
+    """
+    runner = BacktestRunner(datafeed, downcast, cache_dir)
+    runner.set_parameters([instrument], periods, start_time, end_time, ema_windows)
+    runner.strategy_engine.load_strategy(strategy_function, vectorized, factory)
+    runner.run_backtest(instrument=instrument, **strategy_params)
+    return runner.trade_manager.trades_df()
 
 
 # ----------------------------- 可视化函数 -----------------------------
-def plot_results(data, trades_log, instrument):
+def plot_results(data, trades_log, instrument, output_path=None, interactive=False):
     """
-    可视化回测结果。
+    可视化回测结果。默认不弹出窗口，适合批量/并行回测；需要查看图形时传入 interactive=True。
     :param data: K 线数据
-    :param trades_log: 交易记录
+    :param trades_log: 交易记录（TradeManager.trades_df() 或字典列表）
     :param instrument: 标的物代码
+    :param output_path: 图片保存路径，指定时保存为文件
+    :param interactive: 是否调用 plt.show() 显示图形
+    :return: 返回 Figure 对象
     """
-    plt.figure(figsize=(12, 6))
-    plt.plot(data.index, data[f"{instrument}_1m_close"], label='Price')
-    for trade in trades_log:
-        if trade['instrument'] == instrument:
-            if trade['signal'] == 'buy':
-                plt.scatter(trade['time'], trade['price'], color='green', label='Buy', marker='^')
-            elif trade['signal'] == 'sell':
-                plt.scatter(trade['time'], trade['price'], color='red', label='Sell', marker='v')
-    plt.title(f'Backtest Results for {instrument}')
-    plt.xlabel('Time')
-    plt.ylabel('Price')
-    plt.legend()
-    plt.show()
\ No newline at end of file
+    fig, ax = plt.subplots(figsize=(12, 6))
+    ax.plot(data.index, data[f"{instrument}_1m_close"], label='Price')
+    trades = pd.DataFrame(trades_log)
+    if not trades.empty:
+        trades = trades[trades['instrument'] == instrument]
+        signal = signal_codes(trades['signal'])
+        buys = trades[signal == SIG_BUY]
+        sells = trades[signal == SIG_SELL]
+        # 买卖点各画一次，避免逐笔调用 scatter 产生大量图元和重复图例
+        ax.scatter(buys['time'], buys['price'], color='green', label='Buy', marker='^')
+        ax.scatter(sells['time'], sells['price'], color='red', label='Sell', marker='v')
+    ax.set_title(f'Backtest Results for {instrument}')
+    ax.set_xlabel('Time')
+    ax.set_ylabel('Price')
+    ax.legend()
+    if output_path:
+        fig.savefig(output_path, dpi=120)
+    if interactive:
+        plt.show()
+    else:
+        plt.close(fig)  # 非交互模式下及时释放，避免批量回测中 pyplot 累积图形
+    return fig